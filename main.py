@@ -22,9 +22,212 @@
 #       for which the longest set of consecutive positive integers, 1 to n, can be obtained,
 #       giving your answer as a string: abcd.
 
-from itertools import combinations, permutations, product
-from operator import add, mul, sub, truediv
-from typing import List, Tuple
+from functools import lru_cache
+from itertools import combinations, permutations
+from math import prod
+from typing import Callable, Dict, List, Tuple
+
+# Rational numbers are represented as (numerator, denominator) pairs of ints,
+#   so that all arithmetic is exact and no floats are involved.
+# Pairs are never reduced, since a result is an integer exactly when its denominator divides its numerator.
+# Dividing by zero produces the pair (0, 0) instead of raising,
+#   which then carries through any further operations as (0, 0) as well.
+Rational = Tuple[int, int]
+
+
+def combine(x: Rational, y: Rational) -> Tuple[Rational, Rational, Rational, Rational]:
+    """
+    Returns the results of each operation on rationals `x` and `y`, as unreduced pairs.
+    They are in the order of the operation ids: (x + y, x * y, x - y, x / y).
+    """
+    xn, xd = x
+    yn, yd = y
+    return (
+        (xn*yd + yn*xd, xd*yd),
+        (xn*yn, xd*yd),
+        (xn*yd - yn*xd, xd*yd),
+        (xn*yd, xd*yn) if yn else (0, 0),
+    )
+
+
+# All 126 sets of 4 distinct digits (from 1 to 9), each in increasing order
+DIGIT_SETS: Tuple[Tuple[int, int, int, int], ...] = tuple(combinations(range(1, 10), 4))
+
+# Result of an arithmetic expression, along with the ids of its operations op1, op2, op3
+ShapeResult = Tuple[Rational, int, int, int]
+
+# Symbols of the operations, indexed by their ids
+OP_STRS = '+*-/'
+
+# The operations (-,/), which are not commutative
+OPS_NONCOMMUTATIVE = (2, 3)
+
+
+def evaluate_shape0(ra: Rational, rb: Rational, rc: Rational, rd: Rational) -> List[ShapeResult]:
+    """
+    Returns the results of (((a . b) . c) . d) for the digits a,b,c,d (as rationals),
+      for each choice of operations which isn't a duplicate by commutativity.
+    """
+    results = []
+    ab = combine(ra, rb)
+    for i1 in range(4):
+        if i1 < 2 and ra[0] > rb[0]:
+            continue
+        for i2, abc in enumerate(combine(ab[i1], rc)):
+            for i3, abcd in enumerate(combine(abc, rd)):
+                results.append((abcd, i1, i2, i3))
+    return results
+
+
+def evaluate_shape1(ra: Rational, rb: Rational, rc: Rational, rd: Rational) -> List[ShapeResult]:
+    """
+    Returns the results of ((a . b) . (c . d)) for the digits a,b,c,d (as rationals),
+      for each choice of operations which isn't a duplicate by commutativity.
+    """
+    results = []
+    ab = combine(ra, rb)
+    cd = combine(rc, rd)
+    for i1 in range(4):
+        if i1 < 2 and ra[0] > rb[0]:
+            continue
+        for i3 in range(4):
+            if i3 < 2 and rc[0] > rd[0]:
+                continue
+            for i2, abcd in enumerate(combine(ab[i1], cd[i3])):
+                if i2 < 2 and ra[0] > rc[0]:
+                    continue
+                results.append((abcd, i1, i2, i3))
+    return results
+
+
+def evaluate_shape2(ra: Rational, rb: Rational, rc: Rational, rd: Rational) -> List[ShapeResult]:
+    """
+    Returns the results of ((a . (b . c)) . d) for the digits a,b,c,d (as rationals),
+      for each choice of operations which isn't a duplicate by commutativity.
+    """
+    results = []
+    bc = combine(rb, rc)
+    for i2 in range(4):
+        if i2 < 2 and rb[0] > rc[0]:
+            continue
+        abc = combine(ra, bc[i2])
+        for i1 in OPS_NONCOMMUTATIVE:
+            for i3, abcd in enumerate(combine(abc[i1], rd)):
+                results.append((abcd, i1, i2, i3))
+    return results
+
+
+def evaluate_shape3(ra: Rational, rb: Rational, rc: Rational, rd: Rational) -> List[ShapeResult]:
+    """
+    Returns the results of (a . ((b . c) . d)) for the digits a,b,c,d (as rationals),
+      for each choice of operations which isn't a duplicate by commutativity.
+    """
+    results = []
+    bc = combine(rb, rc)
+    for i2 in range(4):
+        if i2 < 2 and rb[0] > rc[0]:
+            continue
+        for i3, bcd in enumerate(combine(bc[i2], rd)):
+            abcd = combine(ra, bcd)
+            for i1 in OPS_NONCOMMUTATIVE:
+                results.append((abcd[i1], i1, i2, i3))
+    return results
+
+
+def evaluate_shape4(ra: Rational, rb: Rational, rc: Rational, rd: Rational) -> List[ShapeResult]:
+    """
+    Returns the results of (a . (b . (c . d))) for the digits a,b,c,d (as rationals),
+      for each choice of operations which isn't a duplicate by commutativity.
+    """
+    results = []
+    cd = combine(rc, rd)
+    for i3 in range(4):
+        if i3 < 2 and rc[0] > rd[0]:
+            continue
+        bcd = combine(rb, cd[i3])
+        for i2 in OPS_NONCOMMUTATIVE:
+            abcd = combine(ra, bcd[i2])
+            for i1 in OPS_NONCOMMUTATIVE:
+                results.append((abcd[i1], i1, i2, i3))
+    return results
+
+
+# The 5 possible parentheses orderings (see `main`),
+#   each as a function evaluating it, along with a format for displaying it
+SHAPES: List[Tuple[Callable[[Rational, Rational, Rational, Rational], List[ShapeResult]], str]] = [
+    (evaluate_shape0, '(({a} {op1} {b}) {op2} {c}) {op3} {d}'),
+    (evaluate_shape1, '({a} {op1} {b}) {op2} ({c} {op3} {d})'),
+    (evaluate_shape2, '({a} {op1} ({b} {op2} {c})) {op3} {d}'),
+    (evaluate_shape3, '{a} {op1} (({b} {op2} {c}) {op3} {d})'),
+    (evaluate_shape4, '{a} {op1} ({b} {op2} ({c} {op3} {d}))'),
+]
+
+# Descriptor of an arithmetic expression, as in:
+#     (shape_id, a, b, c, d, op1_id, op2_id, op3_id)
+#   with ids referring to the orderings in `SHAPES`,
+#   and to the operations (+,*,-,/) in that order.
+Descriptor = Tuple[int, int, int, int, int, int, int, int]
+
+
+@lru_cache(maxsize=None)
+def find_targets(digit_set: Tuple[int, int, int, int]) -> Tuple[bytes, Dict[int, Descriptor]]:
+    """
+    Returns the positive integer targets which can be formed from the 4 digits in `digit_set`,
+      using arithmetic operations (+,-,*,/) and brackets/parentheses,
+      as flags with `flags[t]` set for each target `t`,
+      along with a descriptor of one expression producing each.
+    Results are cached for each `digit_set`, so they shouldn't be modified.
+
+    Args:
+        digit_set (Tuple[int, int, int, int]): 4-tuple of distinct digits
+
+    Returns:
+        (Tuple[bytes, Dict[int, Descriptor]]):
+            Tuple of ...
+              * Flags of positive integer targets reached
+              * Mapping of each positive integer target to the descriptor of an expression for it
+    """
+    # Keep track of positive integer targets (as flags indexed by target),
+    #   as well as one of the expressions which produced it.
+    # By Idea 6 in `main`, no target can exceed 8 * a * b * c * d,
+    #   so the flags go a bit past that to always end with some target not reached.
+    # Expressions are only stored as descriptors, since most of them are never displayed.
+    targets_reached = bytearray(8*prod(digit_set) + 2)
+    targets_by_expression = dict()
+
+    # Many different expressions end up with exactly the same (unreduced) result,
+    #   so keep track of those already checked, and skip them without checking them again
+    values_seen = set()
+
+    # Each digit, paired with itself as a rational,
+    #   so that permuting them doesn't need to rebuild the rationals each time
+    digits_with_rationals = [(x, (x, 1)) for x in digit_set]
+
+    # Run through all possible arithmetic expressions with these digits
+    for (a, ra), (b, rb), (c, rc), (d, rd) in permutations(digits_with_rationals):
+        for shape_id, (evaluate_shape, _) in enumerate(SHAPES):
+            for value, i1, i2, i3 in evaluate_shape(ra, rb, rc, rd):
+                if value in values_seen:
+                    continue
+                values_seen.add(value)
+
+                # Check whether the result is an integer directly from its denominator,
+                #   skipping the division in the common case of a denominator of 1
+                num, den = value
+                if den == 1:
+                    target = num
+                elif den and num % den == 0:
+                    target = num // den
+                else:
+                    continue
+
+                if target > 0 and not targets_reached[target]:
+                    targets_reached[target] = 1
+                    targets_by_expression[target] = (shape_id, a, b, c, d, i1, i2, i3)
+                else:
+                    pass
+
+    return bytes(targets_reached), targets_by_expression
 
 
 def main() -> Tuple[Tuple[int, int, int, int], int, List[str]]:
@@ -104,111 +307,67 @@ def main() -> Tuple[Tuple[int, int, int, int], int, List[str]]:
     #
     #     Not terrible!
 
-    digits_all = [i+1 for i in range(9)]
-    ops_all = [add, mul, sub, truediv]
-    op_strs = {
-        add: '+',
-        mul: '*',
-        sub: '-',
-        truediv: '/',
-    }
+    # Idea 5:
+    #     Since + and * are commutative, many of those expressions are duplicates,
+    #       e.g. ((1 + 2) * 3) - 4 and ((2 + 1) * 3) - 4.
+    #     For a fixed shape, we can skip an expression whenever swapping the operands
+    #       of a commutative operation gives an expression which is kept instead:
+    #       -> (((a . b) . c) . d) : skip if op1 is commutative and a > b
+    #       -> ((a . b) . (c . d)) : skip if op1 is commutative and a > b,
+    #                                     or op3 is commutative and c > d,
+    #                                     or op2 is commutative and a > c
+    #       -> ((a . (b . c)) . d) : skip if op2 is commutative and b > c
+    #       -> (a . ((b . c) . d)) : skip if op2 is commutative and b > c
+    #       -> (a . (b . (c . d))) : skip if op3 is commutative and c > d
+    #
+    #     Also, if op1 is commutative in either of the last 3 shapes,
+    #       the expression is the same as one with `a` moved to the right, which is already of another shape.
+    #     Similarly with op2 in the last shape, the expression is the same as (a . ((c . d) . b)).
+    #     So those can be skipped entirely.
+
+    # Idea 6:
+    #     Could we skip a set of digits without evaluating it,
+    #       by bounding the targets it could possibly reach?
+    #     The product a * b * c * d doesn't work as a bound,
+    #       e.g. {1, 2, 3, 4} reaches all of 1 to 28, but 1 * 2 * 3 * 4 = 24.
+    #
+    #     A proper bound comes from tracking the sizes of numerators and denominators.
+    #     If both of them are at most `x` and `y` for two operands,
+    #       then both of them are at most 2 * x * y for any of (+,-,*,/) applied to those operands.
+    #     Using this 3 times means that no expression can ever exceed 8 * a * b * c * d.
+    #
+    #     But that is at least 8 * 24 = 192 for every set of digits,
+    #       which is far beyond any consecutive chain that actually gets reached.
+    #     So there's no cheap way to skip any of them, and we evaluate all 126.
 
     # Best seen so far
     digits_best = (0, 0, 0, 0)
     t_best = 0
-    expressions_best = []
-
-    for digit_set in combinations(digits_all, 4):
-        # Keep track of positive integer targets,
-        #   as well as one of the expressions which produced it
-        targets_by_expression = dict()
-
-        # Run through all possible arithmetic expressions with these digits
-        for a, b, c, d in permutations(digit_set):
-            for op1, op2, op3 in product(ops_all, repeat=3):
-                # Hardcode the 5 possible parentheses orderings
-                # Won't be pretty but whatever ...
-
-                # (((a . b) . c) . d)
-                # op1 -> op2 -> op3
-                try:
-                    target = op3(op2(op1(a, b), c), d)
-                    if target not in targets_by_expression and int(target) == target and target > 0:
-                        targets_by_expression[int(target)] =\
-                            '(({a} {op1} {b}) {op2} {c}) {op3} {d}'.format(
-                                a=a, b=b, c=c, d=d, op1=op_strs[op1], op2=op_strs[op2], op3=op_strs[op3])
-                    else:
-                        pass
-                except ZeroDivisionError:
-                    pass
-
-                # ((a . b) . (c . d))
-                # op1 -> op3 -> op2
-                # op3 -> op1 -> op2
-                try:
-                    target = op2(op1(a, b), op3(c, d))
-                    if target not in targets_by_expression and int(target) == target and target > 0:
-                        targets_by_expression[int(target)] = \
-                            '({a} {op1} {b}) {op2} ({c} {op3} {d})'.format(
-                                a=a, b=b, c=c, d=d, op1=op_strs[op1], op2=op_strs[op2], op3=op_strs[op3])
-                    else:
-                        pass
-                except ZeroDivisionError:
-                    pass
-
-                # ((a . (b . c)) . d)
-                # op2 -> op1 -> op3
-                try:
-                    target = op3(op1(a, op2(b, c)), d)
-                    if target not in targets_by_expression and int(target) == target and target > 0:
-                        targets_by_expression[int(target)] = \
-                            '({a} {op1} ({b} {op2} {c})) {op3} {d}'.format(
-                                a=a, b=b, c=c, d=d, op1=op_strs[op1], op2=op_strs[op2], op3=op_strs[op3])
-                    else:
-                        pass
-                except ZeroDivisionError:
-                    pass
-
-                # (a . ((b . c) . d))
-                # op2 -> op3 -> op1
-                try:
-                    target = op1(a, op3(op2(b, c), d))
-                    if target not in targets_by_expression and int(target) == target and target > 0:
-                        targets_by_expression[int(target)] = \
-                            '{a} {op1} (({b} {op2} {c}) {op3} {d})'.format(
-                                a=a, b=b, c=c, d=d, op1=op_strs[op1], op2=op_strs[op2], op3=op_strs[op3])
-                    else:
-                        pass
-                except ZeroDivisionError:
-                    pass
-
-                # (a . (b . (c . d)))
-                # op3 -> op2 -> op1
-                try:
-                    target = op1(a, op2(b, op3(c, d)))
-                    if target not in targets_by_expression and int(target) == target and target > 0:
-                        targets_by_expression[int(target)] = \
-                            '{a} {op1} ({b} {op2} ({c} {op3} {d}))'.format(
-                                a=a, b=b, c=c, d=d, op1=op_strs[op1], op2=op_strs[op2], op3=op_strs[op3])
-                    else:
-                        pass
-                except ZeroDivisionError:
-                    pass
+    descriptors_best = []
 
-        # Get length of consecutive target chain
-        t = 1
-        while t in targets_by_expression:
-            t += 1
-        t -= 1
+    # Each set of digits is evaluated independently of the others,
+    #   so the evaluations could be spread over a `multiprocessing.Pool` just by swapping out `map`.
+    # However, all 126 of them only take a fraction of a second in a single process,
+    #   which is less than it takes to start up a pool of worker processes on most platforms.
+    for digit_set, (targets_reached, targets_by_expression) in zip(DIGIT_SETS, map(find_targets, DIGIT_SETS)):
+        # Get length of consecutive target chain,
+        #   which ends just before the first target not reached after 0
+        t = targets_reached.find(0, 1) - 1
 
         # Update best
         if t > t_best:
             digits_best = digit_set
             t_best = t
-            expressions_best = [targets_by_expression[i+1] for i in range(t)]
+            descriptors_best = [targets_by_expression[i+1] for i in range(t)]
         else:
             continue
 
+    # Only now form the readable expressions, for the best digits
+    expressions_best = [
+        SHAPES[shape_id][1].format(a=a, b=b, c=c, d=d, op1=OP_STRS[i1], op2=OP_STRS[i2], op3=OP_STRS[i3])
+        for shape_id, a, b, c, d, i1, i2, i3 in descriptors_best
+    ]
+
     return digits_best, t_best, expressions_best
 
 